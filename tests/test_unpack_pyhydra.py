@@ -0,0 +1,200 @@
+import base64
+import bz2
+import gzip
+import lzma
+import marshal
+import os
+import random
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "tools"))
+
+import unpack_pyhydra as u  # noqa: E402
+
+
+class _ListSink:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        if data:
+            self.writes.append(data)
+
+    @property
+    def data(self):
+        return b"".join(self.writes)
+
+
+def _split(data, rng):
+    cuts = sorted(rng.sample(range(len(data) + 1), min(len(data), rng.randint(0, 6))))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+def _decompress(data, chunk_size=u.CHUNK_SIZE):
+    sink, notes = _ListSink(), []
+    codec = u._decompress_once(u._chunks(data, chunk_size), sink, notes, 3)
+    return codec, sink, notes
+
+
+def test_a85_stream_matches_a85decode_at_any_split():
+    rng = random.Random(1)
+    for _ in range(500):
+        raw = bytes(rng.choice([0, 0, 0, 0, rng.randrange(256)]) for _ in range(rng.randrange(60)))
+        encoded = base64.a85encode(raw, wrapcol=rng.choice([0, 7, 20]))
+        stream = u.A85Stream()
+        decoded = b"".join(stream.iterdecode(_split(encoded, rng)))
+        assert decoded == raw
+
+
+@pytest.mark.parametrize(
+    "codec, compress",
+    [
+        ("zlib", zlib.compress),
+        ("gzip", gzip.compress),
+        ("bz2", bz2.compress),
+        ("xz", lzma.compress),
+    ],
+)
+@pytest.mark.parametrize("chunk_size", [1, 7, u.CHUNK_SIZE])
+def test_decompress_once_per_codec(codec, compress, chunk_size):
+    raw = os.urandom(3000) + b"a" * 5000
+    assert _decompress(compress(raw), chunk_size)[0::2] == (codec, [])
+    assert _decompress(compress(raw), chunk_size)[1].data == raw
+
+
+def test_decompress_once_copies_uncompressed_data():
+    codec, sink, notes = _decompress(b"\xe3plain", 2)
+    assert (codec, sink.data, notes) == (None, b"\xe3plain", [])
+
+
+def test_decompress_once_bounds_each_write():
+    codec, sink, notes = _decompress(zlib.compress(b"\0" * (8 * u.CHUNK_SIZE + 1)))
+    assert len(sink.data) == 8 * u.CHUNK_SIZE + 1
+    assert max(map(len, sink.writes)) <= u.CHUNK_SIZE
+
+
+def test_decompress_once_reports_bytes_after_the_stream():
+    codec, sink, notes = _decompress(zlib.compress(b"a" * 10) + b"JUNK", 3)
+    assert sink.data == b"a" * 10
+    assert notes == ["layer 3 has 4 bytes after the end of the zlib data"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, u.CHUNK_SIZE])
+def test_decompress_once_decodes_concatenated_streams(chunk_size):
+    data = bz2.compress(b"x" * 1000) + bz2.compress(b"y" * 5)
+    codec, sink, notes = _decompress(data, chunk_size)
+    assert sink.data == b"x" * 1000 + b"y" * 5
+    assert notes == ["layer 3 holds 2 concatenated bz2 streams"]
+
+
+def test_decompress_once_reports_truncated_stream():
+    codec, sink, notes = _decompress(lzma.compress(os.urandom(500))[:-20])
+    assert notes == ["layer 3 xz stream ends before its end marker"]
+
+
+def _layer2_blob(tmp_path, program):
+    """A layer 2 code object carrying ``program`` as a85(bz2(xz(...)))."""
+    payload = base64.a85encode(bz2.compress(lzma.compress(program)))
+    code = compile("payload = %r\n" % payload, "<layer2>", "exec")
+    path = tmp_path / "layer2.marshal"
+    path.write_bytes(marshal.dumps(code))
+    return str(path)
+
+
+def _program():
+    full = marshal.dumps(compile("blob = %r\n" % os.urandom(2000), "<layer3>", "exec"))
+    with pytest.raises(EOFError):
+        marshal.loads(full[:-3])
+    return full
+
+
+def test_unpack_code_appends_trailer_that_completes_the_code(tmp_path):
+    full = _program()
+    unpacker = u.Unpacker("-", str(tmp_path))
+    unpacker._trailer = full[-3:]
+    unpacker._unpack_code(_layer2_blob(tmp_path, full[:-3]))
+    entry = unpacker.layers[-1]
+    assert entry["codec"] == "a85+bz2+xz+trailer"
+    assert entry["size"] == len(full)
+    assert (tmp_path / "layer3.marshal").read_bytes() == full
+    assert unpacker.notes == []
+
+
+def test_unpack_code_skips_trailer_when_payload_is_complete(tmp_path):
+    full = _program()
+    unpacker = u.Unpacker("-", str(tmp_path))
+    unpacker._trailer = b"_-\x03"
+    unpacker._unpack_code(_layer2_blob(tmp_path, full))
+    assert unpacker.layers[-1]["codec"] == "a85+bz2+xz"
+    assert (tmp_path / "layer3.marshal").read_bytes() == full
+
+
+@pytest.mark.parametrize("trailer", [b"", b"\xff"])
+def test_unpack_code_leaves_file_as_decoded_when_trailer_does_not_help(tmp_path, trailer):
+    full = _program()
+    unpacker = u.Unpacker("-", str(tmp_path))
+    unpacker._trailer = trailer
+    unpacker._unpack_code(_layer2_blob(tmp_path, full[:-3]))
+    entry = unpacker.layers[-1]
+    assert entry["codec"] == "a85+bz2+xz"
+    assert entry["size"] == len(full) - 3
+    assert (tmp_path / "layer3.marshal").read_bytes() == full[:-3]
+    assert len(unpacker.notes) == 1
+    assert unpacker.notes[0].startswith("layer 3 does not unmarshal")
+
+
+def _protected_file(tmp_path, program):
+    """A minimal file with the shape of a PyHydra output."""
+    blob = marshal.dumps(compile("payload = %r\n" % base64.a85encode(program), "<l2>", "exec"))
+    source = "try:\n    load(read(%r, (lambda v: v ^ 7)(%d)))\nexcept MemoryError:\n    pass\n" % (
+        blob,
+        len(blob) ^ 7,
+    )
+    literal = base64.a85encode(zlib.compress(source.encode()))
+    text = (
+        "class __PyHydragon__:\n"
+        "    def __init__(self):\n"
+        "        x = zlib.decompress(%r)\n"
+        "try:__PyHydragon__().run(%r)\n"
+        "except Exception as e:print(e)\n" % (zlib.compress(b"_-\x03"), literal)
+    )
+    path = tmp_path / "obf.py"
+    path.write_text(text)
+    return str(path)
+
+
+def test_run_peels_every_layer(tmp_path):
+    program = marshal.dumps(compile("x = %r\n" % os.urandom(2000), "<l3>", "exec"))
+    out = tmp_path / "out"
+    unpacker = u.Unpacker(_protected_file(tmp_path, program), str(out))
+    unpacker.run()
+    assert [(e["layer"], e["name"]) for e in unpacker.layers] == [
+        (1, "source"),
+        (2, "code"),
+        (3, "code"),
+    ]
+    assert unpacker.layers[1]["declared_size"] == unpacker.layers[1]["size"]
+    assert (out / "layer3.marshal").read_bytes() == program
+    assert unpacker.notes == []
+
+
+@pytest.mark.parametrize(
+    "content, message",
+    [
+        (None, "error: layer 1: FileNotFoundError"),
+        ("def broken(:\n", "error: layer 1: SyntaxError"),
+        ("__PyHydragon__().run(b'not a85 {')\n", "error: layer 1: ValueError"),
+        ("__PyHydragon__().run(b'87cURD]i,\"Ebo80')\n", "error: layer 1 payload is not zlib"),
+    ],
+)
+def test_main_reports_malformed_input(tmp_path, capsys, content, message):
+    path = tmp_path / "obf.py"
+    if content is not None:
+        path.write_text(content)
+    with pytest.raises(SystemExit) as exc:
+        u.main([str(path), "-o", str(tmp_path / "out")])
+    assert exc.value.code == 1
+    assert capsys.readouterr().err.startswith(message)
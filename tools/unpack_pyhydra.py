@@ -0,0 +1,506 @@
+"""Static, non-executing unpacker for PyHydra-protected files.
+
+Peels every layer of a PyHydra output (such as ``.github/workflows/obf.py``)
+without running any of it:
+
+* layer 1: the ``__PyHydragon__().<name>(b'...')`` literal at the bottom of
+  the file, Ascii85-decoded and zlib-decompressed into Python source;
+* layer 2: the marshalled code object that layer 1 hands to
+  ``PyMarshal_ReadObjectFromString`` as a bytes literal;
+* layer 3: the Ascii85 blob inside that code object, run through its chain of
+  bz2 / xz / zlib compressors and completed with the trailer that the outer
+  ``__PyHydragon__.__init__`` stashes in ``builtins``.
+
+Every layer is decoded as a stream (incremental Ascii85 plus
+``decompressobj``-style decompressors) straight to disk while it is hashed,
+and each stage reads its input back from the previous stage's file, so only
+one layer is held in memory at a time.  Nothing from the payload is ever
+passed to ``exec``, ``eval`` or ``compile``; sources are only inspected with
+``ast.parse``.  Code objects are loaded with ``marshal.loads`` (which does not
+run them) and only when the running interpreter matches the target version.
+
+Usage::
+
+    python tools/unpack_pyhydra.py .github/workflows/obf.py -o unpacked/
+"""
+
+import argparse
+import ast
+import base64
+import bz2
+import hashlib
+import itertools
+import json
+import lzma
+import marshal
+import os
+import re
+import sys
+import time
+import zlib
+
+CHUNK_SIZE = 1 << 16
+
+_A85_WHITESPACE = b" \t\n\r\v"
+_SHEBANG_VERSION = re.compile(rb"^#!\S*python(\d+)\.(\d+)")
+
+
+class UnpackError(Exception):
+    """Raised when a layer does not have the expected PyHydra shape."""
+
+
+# What malformed input surfaces as while a layer is being peeled.
+_LAYER_ERRORS = (SyntaxError, OSError, zlib.error, lzma.LZMAError, EOFError, ValueError)
+
+
+class A85Stream:
+    """Incremental ``base64.a85decode`` that accepts arbitrary chunk sizes."""
+
+    def __init__(self):
+        self._pending = b""
+
+    def decode(self, chunk):
+        data = self._pending + chunk.translate(None, _A85_WHITESPACE)
+        if b"z" not in data:
+            cut = len(data) - len(data) % 5
+        else:
+            cut = pos = 0
+            while pos < len(data):
+                if data[pos] == 0x7A:  # 'z' stands alone for four zero bytes
+                    pos += 1
+                elif pos + 5 <= len(data):
+                    pos += 5
+                else:
+                    break
+                cut = pos
+        self._pending = data[cut:]
+        return _a85decode(data[:cut])
+
+    def flush(self):
+        data, self._pending = self._pending, b""
+        return _a85decode(data)
+
+    def iterdecode(self, chunks):
+        for chunk in chunks:
+            yield self.decode(chunk)
+        yield self.flush()
+
+
+def _a85decode(data):
+    return base64.a85decode(data) if data else b""
+
+
+_MAGIC_LEN = 6
+
+
+def _decompressor(head):
+    """Pick a streaming decompressor from the magic bytes at ``head``."""
+    if head.startswith(b"BZh"):
+        return "bz2", bz2.BZ2Decompressor()
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz", lzma.LZMADecompressor()
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip", zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if len(head) >= 2 and head[0] & 0x0F == 8 and (head[0] << 8 | head[1]) % 31 == 0:
+        return "zlib", zlib.decompressobj()
+    return None, None
+
+
+class _Sink:
+    """Write-through file that hashes and counts what it is given."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file = open(path, "wb")
+
+    def write(self, data):
+        if data:
+            self._file.write(data)
+            self._sha256.update(data)
+            self.size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+
+def _chunks(data, size=CHUNK_SIZE):
+    view = memoryview(data)
+    for start in range(0, len(view), size):
+        yield bytes(view[start:start + size])
+
+
+def _read_chunks(path, size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _drain(d, data, sink):
+    """Feed ``data`` to ``d`` writing at most ``CHUNK_SIZE`` bytes per call."""
+    if hasattr(d, "unconsumed_tail"):  # zlib
+        while True:
+            out = d.decompress(data, CHUNK_SIZE)
+            sink.write(out)
+            data = d.unconsumed_tail
+            if d.eof or (not data and len(out) < CHUNK_SIZE):
+                return
+    sink.write(d.decompress(data, max_length=CHUNK_SIZE))
+    while not d.eof and not d.needs_input:
+        sink.write(d.decompress(b"", max_length=CHUNK_SIZE))
+
+
+def _decompress_once(chunks, sink, notes, layer):
+    """Stream ``chunks`` through one decompressor into ``sink``.
+
+    Concatenated streams of the same codec are decoded one after another;
+    anything else after the end of the data, or a stream that stops before
+    its end marker, is reported in ``notes``.  Returns the codec name, or
+    ``None`` when the data is not compressed (in which case it is copied
+    through unchanged).
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= _MAGIC_LEN:
+            break
+    codec, d = _decompressor(head)
+    if d is None:
+        sink.write(head)
+        for chunk in chunks:
+            sink.write(chunk)
+        return None
+
+    streams, leftover, carry = 1, 0, b""
+    for data in itertools.chain([head], chunks):
+        data, carry = carry + data, b""
+        while data:
+            if d is None:
+                leftover += len(data)
+                break
+            if d.eof:
+                if len(data) < _MAGIC_LEN:  # the next magic may span chunks
+                    carry = data
+                    break
+                next_codec, next_d = _decompressor(data)
+                if next_codec != codec:
+                    d = None
+                    continue
+                d = next_d
+                streams += 1
+            _drain(d, data, sink)
+            data = d.unused_data if d.eof else b""
+    leftover += len(carry)
+    if d is not None and not d.eof:
+        if hasattr(d, "flush"):
+            sink.write(d.flush())
+        notes.append("layer %d %s stream ends before its end marker" % (layer, codec))
+    if streams > 1:
+        notes.append("layer %d holds %d concatenated %s streams" % (layer, streams, codec))
+    if leftover:
+        notes.append(
+            "layer %d has %d bytes after the end of the %s data" % (layer, leftover, codec)
+        )
+    return codec
+
+
+def _fold_int(node):
+    """Statically evaluate the ``(lambda v: v ^ a)(b)`` integer wrapping."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, int):
+        return node.value
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Lambda)
+        and len(node.args) == 1
+        and isinstance(node.func.body, ast.BinOp)
+        and isinstance(node.func.body.op, ast.BitXor)
+    ):
+        arg = _fold_int(node.args[0])
+        key = _fold_int(node.func.body.right)
+        if arg is not None and key is not None:
+            return arg ^ key
+    return None
+
+
+class Unpacker:
+    """Peel the layers of one PyHydra file into ``out_dir``."""
+
+    def __init__(self, path, out_dir):
+        self.path = path
+        self.out_dir = out_dir
+        self.layers = []
+        self.notes = []
+        self.target_version = None
+        self._trailer = b""
+
+    def _out(self, name):
+        return os.path.join(self.out_dir, name)
+
+    def _record(self, layer, name, sink, started, **extra):
+        entry = {
+            "layer": layer,
+            "name": name,
+            "path": sink.path,
+            "size": sink.size,
+            "sha256": sink.sha256,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        entry.update(extra)
+        self.layers.append(entry)
+        return entry
+
+    def _stage(self, layer, step, *args):
+        """Run ``step`` and report malformed input as an ``UnpackError``."""
+        try:
+            return step(*args)
+        except _LAYER_ERRORS as e:
+            raise UnpackError("layer %d: %s: %s" % (layer, type(e).__name__, e)) from e
+
+    def run(self):
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+        except OSError as e:
+            raise UnpackError("cannot create %s: %s" % (self.out_dir, e)) from e
+        source = self._stage(1, self._unpack_outer)
+        blob = self._stage(2, self._unpack_source, source)
+        if blob is None:
+            return self.layers
+        if self.target_version and self.target_version != sys.version_info[:2]:
+            self.notes.append(
+                "layer 2 is a Python %d.%d code object; rerun under that "
+                "interpreter to peel the layers below it" % self.target_version
+            )
+            return self.layers
+        self._stage(3, self._unpack_code, blob)
+        return self.layers
+
+    def _unpack_outer(self):
+        """Layer 1: a85 + zlib literal passed to ``__PyHydragon__()``."""
+        started = time.perf_counter()
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        match = _SHEBANG_VERSION.match(raw)
+        if match:
+            self.target_version = (int(match.group(1)), int(match.group(2)))
+        tree = ast.parse(raw)
+        del raw
+
+        literal = None
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ClassDef) and node.name == "__PyHydragon__":
+                self._trailer = self._find_trailer(node)
+            elif (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Call)
+                and isinstance(node.func.value.func, ast.Name)
+                and node.func.value.func.id == "__PyHydragon__"
+                and node.args
+                and isinstance(node.args[0], ast.Constant)
+                and isinstance(node.args[0].value, bytes)
+            ):
+                literal = node.args[0].value
+        del tree
+        if literal is None:
+            raise UnpackError("no __PyHydragon__() payload literal in %s" % self.path)
+
+        sink = _Sink(self._out("layer1.py"))
+        a85 = A85Stream()
+        codec = _decompress_once(a85.iterdecode(_chunks(literal)), sink, self.notes, 1)
+        sink.close()
+        if codec != "zlib":
+            raise UnpackError("layer 1 payload is not zlib-compressed")
+        self._record(1, "source", sink, started, input_size=len(literal), codec="a85+zlib")
+        return sink.path
+
+    @staticmethod
+    def _find_trailer(classdef):
+        """Bytes that ``__PyHydragon__.__init__`` zlib-decodes into builtins."""
+        for node in ast.walk(classdef):
+            if (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr == "decompress"
+                and node.args
+                and isinstance(node.args[0], ast.Constant)
+                and isinstance(node.args[0].value, bytes)
+            ):
+                try:
+                    return zlib.decompress(node.args[0].value)
+                except zlib.error:
+                    continue
+        return b""
+
+    def _unpack_source(self, source):
+        """Layer 2: marshal blob handed to ``PyMarshal_ReadObjectFromString``."""
+        started = time.perf_counter()
+        best = None
+        with open(source, encoding="utf-8") as f:
+            for line in f:
+                if "(b'" not in line and '(b"' not in line:
+                    continue
+                try:
+                    tree = ast.parse(line.strip())
+                except SyntaxError:
+                    continue
+                for node in ast.walk(tree):
+                    if (
+                        isinstance(node, ast.Call)
+                        and len(node.args) == 2
+                        and isinstance(node.args[0], ast.Constant)
+                        and isinstance(node.args[0].value, bytes)
+                        and (best is None or len(node.args[0].value) > len(best[0]))
+                    ):
+                        best = (node.args[0].value, _fold_int(node.args[1]))
+                del tree
+        if best is None:
+            self.notes.append("layer 1 carries no marshalled payload")
+            return None
+
+        blob, declared = best
+        sink = _Sink(self._out("layer2.marshal"))
+        for chunk in _chunks(blob):
+            sink.write(chunk)
+        sink.close()
+        self._record(2, "code", sink, started, declared_size=declared)
+        if declared is not None and declared != len(blob):
+            self.notes.append(
+                "layer 2 declares %d bytes but carries %d" % (declared, len(blob))
+            )
+        return sink.path
+
+    def _unpack_code(self, blob_path):
+        """Layer 3: a85 blob inside the layer 2 code object."""
+        started = time.perf_counter()
+        with open(blob_path, "rb") as f:
+            try:
+                code = marshal.loads(f.read())
+            except (EOFError, ValueError, TypeError) as e:
+                raise UnpackError("layer 2 does not unmarshal: %s" % e) from e
+
+        payload, embedded = None, []
+        stack = [code]
+        while stack:
+            co = stack.pop()
+            for const in co.co_consts:
+                if hasattr(const, "co_code"):
+                    stack.append(const)
+                elif isinstance(const, bytes) and len(const) > 1024:
+                    if const.startswith(b"#!"):
+                        embedded.append(const)
+                    elif payload is None or len(const) > len(payload):
+                        payload = const
+        del code, stack
+        load_seconds = round(time.perf_counter() - started, 4)
+
+        for index, source in enumerate(embedded):
+            written = time.perf_counter()
+            sink = _Sink(self._out("layer2-embedded%d.py" % index))
+            sink.write(source)
+            sink.close()
+            self._record(2, "embedded source", sink, written)
+        if payload is None:
+            self.notes.append("layer 2 carries no a85 payload")
+            return
+
+        started = time.perf_counter()
+
+        stage_path = self._out("layer3.a85")
+        sink = _Sink(stage_path)
+        a85 = A85Stream()
+        for chunk in a85.iterdecode(_chunks(payload)):
+            sink.write(chunk)
+        sink.close()
+        del payload
+
+        codecs = []
+        while True:
+            next_path = stage_path + ".next"
+            sink = _Sink(next_path)
+            codec = _decompress_once(_read_chunks(stage_path), sink, self.notes, 3)
+            sink.close()
+            if codec is None:
+                os.remove(next_path)
+                break
+            codecs.append(codec)
+            os.replace(next_path, stage_path)
+
+        with open(stage_path, "rb") as f:
+            data = f.read()
+        trailer = b""
+        try:
+            marshal.loads(data)
+        except (EOFError, ValueError, TypeError) as e:
+            if not self._trailer:
+                self.notes.append("layer 3 does not unmarshal and no trailer was found: %s" % e)
+            else:
+                try:
+                    marshal.loads(data + self._trailer)
+                    trailer = self._trailer
+                except (EOFError, ValueError, TypeError) as e:
+                    self.notes.append(
+                        "layer 3 does not unmarshal, with or without the %d-byte "
+                        "trailer: %s" % (len(self._trailer), e)
+                    )
+        del data
+
+        final = _Sink(self._out("layer3.marshal"))
+        for chunk in _read_chunks(stage_path):
+            final.write(chunk)
+        os.remove(stage_path)
+        if trailer:
+            final.write(trailer)
+            codecs.append("trailer")
+        final.close()
+        self._record(
+            3, "code", final, started, load_seconds=load_seconds, codec="a85+" + "+".join(codecs)
+        )
+
+    def manifest(self):
+        return {"input": self.path, "layers": self.layers, "notes": self.notes}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="PyHydra-protected file to unpack")
+    parser.add_argument("-o", "--out-dir", default="unpacked", help="output directory")
+    parser.add_argument("--json", action="store_true", help="print the manifest as JSON")
+    args = parser.parse_args(argv)
+
+    unpacker = Unpacker(args.path, args.out_dir)
+    try:
+        unpacker.run()
+    except UnpackError as e:
+        parser.exit(1, "error: %s\n" % e)
+    manifest = unpacker.manifest()
+    with open(os.path.join(args.out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if args.json:
+        json.dump(manifest, sys.stdout, indent=2)
+        print()
+        return 0
+    for entry in manifest["layers"]:
+        print(
+            "layer %(layer)d %(name)-15s %(size)10d B  %(seconds)8.3fs  "
+            "%(sha256).16s  %(path)s" % entry
+        )
+    for note in manifest["notes"]:
+        print("note:", note)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())